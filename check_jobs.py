@@ -1,49 +1,242 @@
 import os
-import json
+import html
 import hashlib
-from urllib.parse import urljoin
+import re
+import time
+import uuid
+from functools import lru_cache
+from urllib.parse import quote, urljoin
 
+import orjson
 import requests
+import soupsieve
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-STATE_FILE = "jobs_seen.json"
+STATE_FILE = "jobs_seen.jsonl"
+HTTP_CACHE_FILE = "jobs_http_cache.json"
+
+# Seen jobs not listed for this long (seconds) are forgotten
+SEEN_JOBS_TTL = 90 * 24 * 60 * 60
+# A listed job's last-seen time is only rewritten once it is this old,
+# so the state file does not change on every run
+SEEN_JOBS_REFRESH = SEEN_JOBS_TTL // 2
+MAX_SEEN_JOBS = 50_000
+
+# Longest Retry-After (seconds) honored before retrying a request
+MAX_RETRY_WAIT = 60
+
+# Discord rejects messages over 2000 characters; leave headroom
+WEBHOOK_CONTENT_LIMIT = 1800
+# Attempts per message when the webhook answers 429 Too Many Requests
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# Fallback when no JOB_SELECTOR is given: any link that looks job-ish
+_FALLBACK_SELECTOR = soupsieve.compile('a[href*="job" i]')
+
+_EMAIL_HEAD = "<h2>New job(s) on {site_name}</h2>\n<ul>"
+_EMAIL_TAIL = "</ul>"
+
+_MARKDOWN_SPECIAL = re.compile(r"([\\`*_~|\[\]])")
+
+
+@lru_cache(maxsize=64)
+def _compile_selector(selector):
+    """Compile a CSS selector once per unique string."""
+    return soupsieve.compile(selector)
+
+
+class _CappedRetry(Retry):
+    """Retry that honors Retry-After, but never waits over MAX_RETRY_WAIT."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_WAIT)
+
+
+def create_session():
+    """Create a pooled HTTP session shared by page fetches and webhooks."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=_CappedRetry(
+            total=2,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "job-watcher/1.0 (+https://github.com/brandonb77706/job_watcher)"
+    return session
+
+
+# Reused across requests so repeated hits to the same host skip the TCP/TLS handshake
+_SESSION = create_session()
 
 
 def load_seen_jobs():
-    """Load previously seen jobs from a local JSON file."""
+    """
+    Load previously seen jobs from the local JSON Lines state file.
+
+    Returns (seen, line_count) where seen maps job ID -> {"title", "link", "ts"}
+    in the order jobs were first seen. "ts" is when the job was last seen
+    listed, refreshed at most every SEEN_JOBS_REFRESH seconds.
+    """
+    seen = {}
+    line_count = 0
     if not os.path.exists(STATE_FILE):
+        return seen, line_count
+
+    with open(STATE_FILE, "rb") as f:
+        for line in f:
+            line_count += 1
+            try:
+                record = orjson.loads(line)
+                seen[record.pop("id")] = record
+            except Exception:
+                # Skip corrupted lines; compaction drops them later
+                continue
+
+    return seen, line_count
+
+
+def _state_line(job_id, info):
+    return orjson.dumps({"id": job_id, **info}) + b"\n"
+
+
+def append_seen_jobs(seen, new_jobs):
+    """Append newly seen jobs to the state file."""
+    with open(STATE_FILE, "ab") as f:
+        for job in new_jobs:
+            f.write(_state_line(job["id"], seen[job["id"]]))
+
+
+def compact_seen_jobs(seen):
+    """Atomically rewrite the state file with one line per seen job."""
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb", buffering=1 << 20) as f:
+        for job_id, info in seen.items():
+            f.write(_state_line(job_id, info))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_FILE)
+
+
+def prune_seen_jobs(seen, listed_ids):
+    """
+    Drop seen jobs last seen more than SEEN_JOBS_TTL ago, then the least
+    recently seen ones beyond MAX_SEEN_JOBS.
+
+    Jobs in listed_ids are still on the page and are never dropped, so they
+    cannot be reported as new again. Returns the number of jobs dropped.
+    """
+    cutoff = time.time() - SEEN_JOBS_TTL
+    stale = [
+        job_id
+        for job_id, info in seen.items()
+        if job_id not in listed_ids and info.get("ts", 0) < cutoff
+    ]
+
+    overflow = len(seen) - len(stale) - MAX_SEEN_JOBS
+    if overflow > 0:
+        stale_ids = set(stale)
+        candidates = [
+            job_id
+            for job_id in seen
+            if job_id not in listed_ids and job_id not in stale_ids
+        ]
+        candidates.sort(key=lambda job_id: seen[job_id].get("ts", 0))
+        stale.extend(candidates[:overflow])
+
+    for job_id in stale:
+        del seen[job_id]
+    return len(stale)
+
+
+def load_http_cache():
+    """Load per-URL response validators and job lists from the last run."""
+    if not os.path.exists(HTTP_CACHE_FILE):
         return {}
     try:
-        with open(STATE_FILE, "r") as f:
-            return json.load(f)
+        with open(HTTP_CACHE_FILE, "rb") as f:
+            return orjson.loads(f.read())
     except Exception:
-        # If file is corrupted or unreadable, start fresh
+        # If file is corrupted or unreadable, fetch unconditionally
         return {}
 
 
-def save_seen_jobs(seen):
-    """Save seen jobs to a local JSON file."""
-    with open(STATE_FILE, "w") as f:
-        json.dump(seen, f, indent=2)
+def save_http_cache(cache):
+    """Save per-URL response validators and job lists."""
+    with open(HTTP_CACHE_FILE, "wb") as f:
+        f.write(orjson.dumps(cache))
 
 
-def fetch_jobs(url, selector=None):
+def fetch_jobs(url, selector=None, cache=None):
     """
     Fetch job listings from a page.
 
+    If cache is given, the request is made conditional on the ETag /
+    Last-Modified validators stored for url, and the cached jobs are returned
+    on 304 Not Modified or when the body hashes the same as last time. The
+    entry is replaced whenever a full fetch extracts a different job list.
+
     Returns a list of dicts: {"id": str, "title": str, "link": str}
     """
-    resp = requests.get(url, timeout=20)
+    entry = cache.get(url) if cache is not None else None
+    if entry and entry.get("selector") != selector:
+        # Cached jobs were extracted with a different selector
+        entry = None
+
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = _SESSION.get(url, headers=headers, timeout=20)
+    if entry and resp.status_code == 304:
+        return entry["jobs"]
     resp.raise_for_status()
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+    body_hash = hashlib.blake2b(resp.content, digest_size=16).hexdigest()
+    if entry and entry.get("body_hash") == body_hash:
+        # Server ignored the validators but the page is unchanged
+        jobs = entry["jobs"]
+    else:
+        jobs = _extract_jobs(resp, selector)
+
+    # Only replace the entry when the extracted jobs change: dynamic pages
+    # send a new ETag and body on every request, and rewriting the committed
+    # cache for those would create a commit on every run
+    if cache is not None and (
+        entry is None or [job["id"] for job in entry["jobs"]] != [job["id"] for job in jobs]
+    ):
+        cache[url] = {
+            "selector": selector,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "body_hash": body_hash,
+            "jobs": jobs,
+        }
+
+    return jobs
+
+
+def _extract_jobs(resp, selector):
+    """Parse a page response into a list of job dicts."""
+    # Pass raw bytes so lxml detects the encoding itself
+    soup = BeautifulSoup(resp.content, "lxml")
 
     if selector:
-        elements = soup.select(selector)
+        elements = _compile_selector(selector).select(soup)
     else:
-        # Fallback: any link that looks job-ish
-        elements = soup.find_all("a", href=True)
-        elements = [a for a in elements if "job" in a["href"].lower()]
+        elements = _FALLBACK_SELECTOR.select(soup)
 
     jobs = []
     base = resp.url  # handle redirects
@@ -61,7 +254,7 @@ def fetch_jobs(url, selector=None):
 
         # Create stable ID based on title+link
         raw_id = f"{text}|{link}"
-        job_id = hashlib.sha256(raw_id.encode("utf-8")).hexdigest()[:16]
+        job_id = hashlib.blake2b(raw_id.encode("utf-8"), digest_size=8).hexdigest()
 
         jobs.append(
             {
@@ -74,23 +267,138 @@ def fetch_jobs(url, selector=None):
     return jobs
 
 
+def _escape_markdown(text):
+    """Backslash-escape characters Discord treats as Markdown formatting."""
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", text)
+
+
+def _markdown_link(title, link, max_len):
+    """Build a Markdown link no longer than max_len, clipping the title."""
+    # Percent-encode parentheses and spaces so they cannot end the URL early
+    url = quote(link, safe=":/?#[]@!$&'*+,;=%")
+    text = _escape_markdown(title)
+    room = max_len - len(url) - len("[]()")
+    if len(text) > room:
+        text = text[: max(room - 1, 0)]
+        # Don't leave a dangling backslash escaping the ellipsis
+        if (len(text) - len(text.rstrip("\\"))) % 2:
+            text = text[:-1]
+        text += "…"
+    return f"[{text}]({url})"
+
+
+def _chunk_lines(lines, limit):
+    """
+    Group lines into newline-joined messages no longer than limit.
+
+    As a last resort, a single line longer than limit is truncated so it
+    still fits.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        if len(line) > limit:
+            line = line[: limit - 1] + "…"
+        # +1 for the joining newline
+        if chunk and size + len(line) + 1 > limit:
+            yield "\n".join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def _retry_after(resp):
+    """Seconds to wait before retrying a rate-limited webhook request."""
+    try:
+        delay = float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        try:
+            # Discord also reports the delay in the JSON body
+            delay = float(resp.json()["retry_after"])
+        except Exception:
+            delay = 1.0
+    return min(max(delay, 0.0), MAX_RETRY_WAIT)
+
+
+def _post_webhook(webhook_url, payload):
+    """
+    POST one webhook message, waiting out rate limits (HTTP 429).
+
+    Returns how many seconds to wait before sending another message.
+    """
+    # The session's Retry policy doesn't cover POST, so 429s are handled here
+    for attempt in range(WEBHOOK_MAX_ATTEMPTS):
+        resp = _SESSION.post(
+            webhook_url,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=15,
+        )
+        if resp.status_code != 429 or attempt == WEBHOOK_MAX_ATTEMPTS - 1:
+            break
+        time.sleep(_retry_after(resp))
+    resp.raise_for_status()
+
+    # Discord reports when the rate-limit bucket is empty; the caller waits
+    # it out before the next message instead of tripping a 429
+    if resp.headers.get("X-RateLimit-Remaining") != "0":
+        return 0.0
+    try:
+        delay = float(resp.headers.get("X-RateLimit-Reset-After", 1))
+    except ValueError:
+        delay = 1.0
+    return min(max(delay, 0.0), MAX_RETRY_WAIT)
+
+
 def send_webhook_notification(webhook_url, site_name, new_jobs):
-    """Optional: send a Discord-style webhook notification."""
+    """
+    Optional: send a Discord-style webhook notification.
+
+    Jobs are split across several messages so each stays under
+    WEBHOOK_CONTENT_LIMIT characters.
+    """
     if not webhook_url or not new_jobs:
         return
 
-    lines = [f"📢 New job(s) detected on **{site_name}**:"]
+    lines = [f"📢 New job(s) detected on **{_escape_markdown(site_name)}**:"]
     for job in new_jobs:
-        lines.append(f"- [{job['title']}]({job['link']})")
+        link = _markdown_link(job["title"], job["link"], WEBHOOK_CONTENT_LIMIT - len("- "))
+        lines.append(f"- {link}")
 
-    content = "\n".join(lines)
-    payload = {"content": content}
+    delay = 0.0
+    for content in _chunk_lines(lines, WEBHOOK_CONTENT_LIMIT):
+        # Only pause when another message actually follows
+        if delay:
+            time.sleep(delay)
+        delay = _post_webhook(webhook_url, orjson.dumps({"content": content}))
 
-    resp = requests.post(webhook_url, json=payload, timeout=15)
-    resp.raise_for_status()
+
+def iter_email_body(site_name, new_jobs):
+    """Yield the lines of the HTML email body, escaping scraped text."""
+    yield _EMAIL_HEAD.format(site_name=html.escape(site_name))
+    for job in new_jobs:
+        link = html.escape(job["link"])
+        title = html.escape(job["title"])
+        yield f"<li><a href='{link}'>{title}</a></li>"
+    yield _EMAIL_TAIL
+
+
+def create_email_body(site_name, new_jobs):
+    """Build the HTML email body listing new jobs."""
+    return "\n".join(iter_email_body(site_name, new_jobs))
 
 
 def main():
+    try:
+        run()
+    finally:
+        _SESSION.close()
+
+
+def run():
     job_url = os.environ.get("JOB_URL")
     if not job_url:
         raise RuntimeError("JOB_URL is not set")
@@ -103,34 +411,43 @@ def main():
     if selector:
         print(f"Using CSS selector: {selector}")
 
-    current_jobs = fetch_jobs(job_url, selector)
+    http_cache = load_http_cache()
+    current_jobs = fetch_jobs(job_url, selector, http_cache)
     print(f"Found {len(current_jobs)} job elements")
 
-    seen = load_seen_jobs()
+    seen, state_lines = load_seen_jobs()
 
+    now = int(time.time())
     new_jobs = []
+    refreshed = 0
     for job in current_jobs:
-        if job["id"] not in seen:
+        info = seen.get(job["id"])
+        if info is None:
             new_jobs.append(job)
             seen[job["id"]] = {
                 "title": job["title"],
                 "link": job["link"],
+                "ts": now,
             }
+        elif info.get("ts", 0) < now - SEEN_JOBS_REFRESH:
+            info["ts"] = now
+            refreshed += 1
+
+    # An empty result is more likely a bot check or layout change than every
+    # job being pulled at once; don't let it expire the whole state
+    pruned = 0
+    if current_jobs:
+        pruned = prune_seen_jobs(seen, {job["id"] for job in current_jobs})
+    if pruned:
+        print(f"Forgot {pruned} old job(s) no longer listed")
 
-    has_new = False
-    email_body = ""
+    has_new = bool(new_jobs)
 
     if new_jobs:
-        has_new = True
         print(f"🚀 Found {len(new_jobs)} new job(s):")
 
-        # Build HTML body for email
-        lines = [f"<h2>New job(s) on {site_name}</h2>", "<ul>"]
         for job in new_jobs:
             print(f"- {job['title']} | {job['link']}")
-            lines.append(f"<li><a href='{job['link']}'>{job['title']}</a></li>")
-        lines.append("</ul>")
-        email_body = "\n".join(lines)
 
         # Optional: Discord / webhook
         if webhook_url:
@@ -142,21 +459,34 @@ def main():
     else:
         print("No new jobs since last check.")
 
-    save_seen_jobs(seen)
+    if pruned or refreshed or state_lines > 2 * len(seen):
+        # Records were dropped or updated, or duplicate/corrupted lines have
+        # piled up; rewrite the file
+        compact_seen_jobs(seen)
+    elif new_jobs:
+        append_seen_jobs(seen, new_jobs)
+    save_http_cache(http_cache)
     print("State updated and saved.")
 
     # 🔥 Expose outputs for GitHub Actions using Environment Files
     # (used by the email step in job-check.yml)
     github_output = os.environ.get("GITHUB_OUTPUT")
     if github_output:
-        with open(github_output, "a") as f:
+        with open(github_output, "a", buffering=1 << 20) as f:
             f.write(f"has_new={str(has_new).lower()}\n")
-            # Use multiline format for email_body to handle special characters
-            f.write("email_body<<EOF\n")
-            f.write(f"{email_body}\n")
-            f.write("EOF\n")
+            # Use multiline format for email_body to handle special characters;
+            # a random delimiter can't collide with a line of scraped text
+            delimiter = f"EOF_{uuid.uuid4().hex}"
+            f.write(f"email_body<<{delimiter}\n")
+            if has_new:
+                # Stream the body instead of building it as one string
+                f.writelines(f"{line}\n" for line in iter_email_body(site_name, new_jobs))
+            else:
+                f.write("\n")
+            f.write(f"{delimiter}\n")
     else:
         # Fallback for local testing
+        email_body = create_email_body(site_name, new_jobs) if has_new else ""
         print(f"has_new={str(has_new).lower()}")
         print(f"email_body={email_body}")
 